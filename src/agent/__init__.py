@@ -1,9 +1,10 @@
 from .category_agent import category_update_paper_info
-from .mistake_agent import mistakes_update_paper_info
+from .mistake_agent import mistakes_update_paper_info, mistakes_retry_pages
 
 __all__ = [
     "category_update_paper_info",
-    "mistakes_update_paper_info"
+    "mistakes_update_paper_info",
+    "mistakes_retry_pages"
 ]
 
 
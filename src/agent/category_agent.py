@@ -1,31 +1,38 @@
+from __future__ import annotations
+
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
-from typing import Any, Annotated
+from typing import Any, Annotated, TYPE_CHECKING
 from typing_extensions import TypedDict
 
-import cv2
 import filetype
 
 from pydantic import SecretStr, Field
-from pydantic_ai import Agent, BinaryContent
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
 
 from paper_typing import PaperFile
 
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
+
 class Category(TypedDict):
     subject: Annotated[str, Field(description="学科名称")]
     title: Annotated[str, Field(description="试卷的标题")]
 
-def initialize_agent() -> Agent[None, Category]:
+@lru_cache(maxsize=None)
+def get_category_agent() -> Agent[None, Category]:
     """
-    创建 Agent 实例
+    获取 Agent 实例（首次调用时创建，之后复用）
     :return: Agent 实例
     """
+    from pydantic_ai import Agent
+    from pydantic_ai.models.openai import OpenAIModel
+    from pydantic_ai.providers.openai import OpenAIProvider
+
     # 加载环境变量
+    # 抛出普通异常，使失败被记录到 failed_handlers，而不是中途退出进程
     if not load_dotenv():
-        print("环境变量加载失败")
-        exit(1)
+        raise RuntimeError("环境变量加载失败")
 
     base_url = os.getenv('LLM_BASE_URL', '')
     api_key = SecretStr(os.getenv('LLM_API_KEY', ''))
@@ -43,9 +50,10 @@ def initialize_agent() -> Agent[None, Category]:
     """))
     return agent
 
-categoryAgent = initialize_agent()
+async def category_update_paper_info(info:dict[str, Any], s_file: PaperFile, source: str) -> None: # pyright: ignore[reportExplicitAny, reportUnusedParameter]
+    import cv2
+    from pydantic_ai import BinaryContent
 
-async def category_update_paper_info(info:dict[str, Any], s_file: PaperFile) -> None: # pyright: ignore[reportExplicitAny]
     if isinstance(s_file, list):
         b = BinaryContent(data=cv2.imencode('.png', s_file[0])[1].tobytes(), media_type='image/png')
     else:
@@ -62,6 +70,6 @@ async def category_update_paper_info(info:dict[str, Any], s_file: PaperFile) ->
             b = BinaryContent(data=f.read(), media_type=str(kind.mime)) # pyright: ignore[reportUnknownArgumentType]
         
     
-    paper_hint = await categoryAgent.run([b])
+    paper_hint = await get_category_agent().run([b])
     # 使用新添加的 parse_json 函数处理返回的文本
     info.update(paper_hint.data)
@@ -1,21 +1,23 @@
+from __future__ import annotations
+
 import os
+import glob
+import asyncio
+from functools import lru_cache
 from dotenv import load_dotenv
-from typing import Any, Annotated
+from typing import Any, Annotated, TYPE_CHECKING
 from typing_extensions import TypedDict
 from datetime import datetime
 
-import cv2
-
 import filetype  # pyright: ignore[reportMissingTypeStubs]
 
 from pydantic import Field
 from pydantic import SecretStr
-from pydantic_ai import Agent, BinaryContent
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
 
 from paper_typing import PaperFile
-import logfire
+
+if TYPE_CHECKING:
+    from pydantic_ai import Agent, BinaryContent
 
 class Mistake(TypedDict):
     question: Annotated[str, Field(description="错题题目摘录，注意：只需要题目，不要包含答案。")]
@@ -24,15 +26,23 @@ class Mistake(TypedDict):
 class Response(TypedDict):
     mistakes: Annotated[list[Mistake], Field(description="错误题列表")]
 
-def initialize_agent() -> Agent[None, Response]:
+class PageMistake(Mistake):
+    page: int  # 错题所在页码（从 0 开始），由程序补充，不属于模型输出
+
+@lru_cache(maxsize=None)
+def get_mistakes_agent() -> Agent[None, Response]:
     """
-    创建 Agent 实例
+    获取 Agent 实例（首次调用时创建，之后复用）
     :return: Agent 实例
     """
+    from pydantic_ai import Agent
+    from pydantic_ai.models.openai import OpenAIModel
+    from pydantic_ai.providers.openai import OpenAIProvider
+
     # 加载环境变量
+    # 抛出普通异常，使失败被记录到 failed_handlers，而不是中途退出进程
     if not load_dotenv():
-        print("环境变量加载失败")
-        exit(1)
+        raise RuntimeError("环境变量加载失败")
 
     base_url = os.getenv('LLM_BASE_URL', '')
     api_key = SecretStr(os.getenv('LLM_API_KEY', ''))
@@ -48,18 +58,14 @@ def initialize_agent() -> Agent[None, Response]:
     return agent
 
 
-mistakes_agent = initialize_agent()
-
-async def mistakes_update_paper_info(info:dict[str, Any], s_file: PaperFile) -> None: # pyright: ignore[reportExplicitAny]
+def _build_messages(s_file: PaperFile) -> list[BinaryContent] | None:
     """
-    统计试卷错误
-    :param info: 试卷扫描图
+    将试卷的每一页转换为模型输入
+    :param s_file: 图片路径或 PDF 页面图片列表
+    :return: 每页对应的 BinaryContent，文件类型不支持时返回 None
     """
-    # 加载环境变量
-    if not load_dotenv():
-        print("环境变量加载失败")
-        exit(1)
-    error_dir = os.getenv('ERROR_DIR', './errors')  # 默认值保持向后兼容
+    import cv2
+    from pydantic_ai import BinaryContent
 
     messages: list[BinaryContent] = []
     if isinstance(s_file, list):
@@ -70,19 +76,35 @@ async def mistakes_update_paper_info(info:dict[str, Any], s_file: PaperFile) ->
         kind = filetype.guess(s_file)  # pyright: ignore[reportUnknownMemberType]
         if kind is None:
             print('无法判断文件类型!')
-            return
+            return None
         if kind.extension not in ['jpg', 'png', 'jpeg']:
             print('不支持文件类型!', s_file)
-            return
-        kind.mime
+            return None
         with open(s_file, 'rb') as f:
             b = BinaryContent(data=f.read(), media_type=str(kind.mime)) # pyright: ignore[reportUnknownArgumentType]
             messages.append(b)
+    return messages
+
+async def _analyze_pages(messages: dict[int, BinaryContent], source: str,
+                         concurrency: int) -> tuple[list[PageMistake], list[int]]:
+    """
+    分析指定页的错题，最多同时提交 concurrency 页。
+    失败页的图片保存为 ERROR_DIR/error_<试卷名>_p<页码>_<时间>.png.base64，该页重试成功后删除。
+    :param messages: 页码 -> 页面内容
+    :param source: 试卷文件路径
+    :param concurrency: 并发数，至少为 1
+    :return: 按页码排序、标注页码的错题列表, 处理失败的页码
+    """
+    import logfire
 
+    # 创建 Agent 时已加载环境变量
+    mistakes_agent = get_mistakes_agent()
+    error_dir = os.getenv('ERROR_DIR', './errors')  # 默认值保持向后兼容
+    paper_name = os.path.splitext(os.path.basename(source))[0]
+    semaphore = asyncio.Semaphore(concurrency)
 
-    with logfire.span("mistakes_agent"):
-        all_mistakes: list[Mistake] = []
-        for i, msg in enumerate(messages):
+    async def analyze(i: int, msg: BinaryContent) -> list[Mistake] | None:
+        async with semaphore:
             try:
                 logfire.info("    正在处理第{n}张图片...", n=i+1)
                 paper_mistakes = await mistakes_agent.run([
@@ -90,17 +112,80 @@ async def mistakes_update_paper_info(info:dict[str, Any], s_file: PaperFile) ->
                     msg])
                 _mistakes = paper_mistakes.data["mistakes"]
                 logfire.info("    第{n}张图片处理完成，共发现{s}个错误题。", n=i+1, s=len(_mistakes))
-                all_mistakes.extend(_mistakes)
+                # 删除该页之前失败时保存的错误图片
+                pattern = os.path.join(glob.escape(error_dir), f"error_{glob.escape(paper_name)}_p{i}_*.png.base64")
+                for error_file_path in glob.glob(pattern):
+                    os.remove(error_file_path)
+                return _mistakes
             except Exception as e:
                 logfire.error("    第{n}张图片处理失败: {e}", n=i+1, e=str(e))
                 # 保存错误图片
                 if not os.path.exists(error_dir):
                     os.makedirs(error_dir)
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                error_file = f"error_{timestamp}_p{i}.png.base64"
+                error_file = f"error_{paper_name}_p{i}_{timestamp}.png.base64"
                 error_file_path = os.path.join(error_dir, error_file)
                 with open(error_file_path, 'wb') as f:
                     f.write(msg.data)
+                return None
+
+    pages = sorted(messages)
+    results = await asyncio.gather(*(analyze(i, messages[i]) for i in pages))
+    all_mistakes: list[PageMistake] = []
+    failed_pages: list[int] = []
+    for i, _mistakes in zip(pages, results):
+        if _mistakes is None:
+            failed_pages.append(i)
+        else:
+            all_mistakes.extend({**m, "page": i} for m in _mistakes)
+    return all_mistakes, failed_pages
+
+def _update_mistakes(info: dict[str, Any], mistakes: list[PageMistake], failed_pages: list[int]) -> None: # pyright: ignore[reportExplicitAny]
+    # 按页码排序（稳定排序保留同一页内的顺序），重试合并后仍与原页序一致
+    mistakes = sorted(mistakes, key=lambda m: m.get("page", 0))
+    info.update({"mistakes": mistakes,
+                 "mistakes_count": len(mistakes)})
+    # 记录处理失败的页码，供 detect.py --retry-failed 重新提交
+    if failed_pages:
+        info["failed_pages"] = failed_pages
+    else:
+        info.pop("failed_pages", None)
+
+async def mistakes_update_paper_info(info:dict[str, Any], s_file: PaperFile, source: str) -> None: # pyright: ignore[reportExplicitAny]
+    """
+    统计试卷错误
+    :param info: 试卷扫描图
+    :param source: 试卷文件路径，用于命名失败页的错误图片
+    """
+    import logfire
+
+    messages = _build_messages(s_file)
+    if messages is None:
+        return
+
+    with logfire.span("mistakes_agent"):
+        # 逐页顺序处理
+        all_mistakes, failed_pages = await _analyze_pages(dict(enumerate(messages)), source, concurrency=1)
+
+    _update_mistakes(info, all_mistakes, failed_pages)
+
+async def mistakes_retry_pages(info:dict[str, Any], s_file: PaperFile, source: str, concurrency: int = 4) -> None: # pyright: ignore[reportExplicitAny]
+    """
+    仅重新提交 info["failed_pages"] 中记录的页，并将结果合并到已有错题中
+    :param info: 已保存的试卷识别结果
+    :param s_file: 试卷扫描图
+    :param source: 试卷文件路径
+    :param concurrency: 并发数
+    """
+    import logfire
+
+    messages = _build_messages(s_file)
+    if messages is None:
+        return
+    pages: list[int] = info.get("failed_pages", [])
+    targets = {i: messages[i] for i in pages if i < len(messages)}
+
+    with logfire.span("mistakes_agent_retry"):
+        retried_mistakes, failed_pages = await _analyze_pages(targets, source, concurrency)
 
-    info.update({"mistakes": all_mistakes, 
-                 "mistakes_count": len(all_mistakes)})
+    _update_mistakes(info, info.get("mistakes", []) + retried_mistakes, failed_pages)
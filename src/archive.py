@@ -6,7 +6,12 @@ from typing import Any
 from datetime import datetime
 import click
 
+import dedup
+
+DUPLICATES_DIR_NAME = '_duplicates'
+
 def process_files(paper_dir: str, target_dir: str):
+    index_path = os.path.join(paper_dir, dedup.INDEX_FILE_NAME)
     # 遍历 paper 目录下的所有文件
     for root, _, files in os.walk(paper_dir):
         for file in files:
@@ -23,6 +28,25 @@ def process_files(paper_dir: str, target_dir: str):
                 with open(json_file_path, 'r', encoding='utf-8') as json_file:
                     data: dict[str, Any] = json.load(json_file) # pyright: ignore[reportExplicitAny]
 
+                # 部分完成的结果需先用 detect.py --retry-failed 补全
+                if data.get('failed_handlers') or data.get('failed_pages'):
+                    print(f'{file} 未全部识别完成，跳过归档')
+                    continue
+
+                # 重复扫描的试卷标题与已归档的原件相同，按标题归档会覆盖原件，
+                # 因此保留原扫描文件名移入 _duplicates 目录（web.py 不显示 _ 开头的目录），确认无用后可整体删除
+                if data.get('duplicate_of'):
+                    duplicates_dir = os.path.join(target_dir, DUPLICATES_DIR_NAME)
+                    os.makedirs(duplicates_dir, exist_ok=True)
+                    for src_path, name in [(os.path.join(root, file), file),
+                                           (json_file_path, f'{file_base_name}.json')]:
+                        dst_path = os.path.join(duplicates_dir, name)
+                        if os.path.exists(dst_path):
+                            os.remove(dst_path)
+                        shutil.move(src_path, dst_path)
+                    print(f'{file} 与 {data["duplicate_of"]} 重复，已移入 {duplicates_dir}')
+                    continue
+
                 # 从 json 数据中提取所需信息
                 subject:str = data.get('subject', '未知学科')
                 ym = datetime.now().strftime('%Y-%m')
@@ -48,6 +72,9 @@ def process_files(paper_dir: str, target_dir: str):
                 if os.path.exists(new_json_path):
                     os.remove(new_json_path)
                 shutil.move(json_file_path, new_json_path)  # 新增移动JSON文件
+                # 同步更新感知哈希索引，使重扫的试卷仍能复用归档后的结果
+                dedup.relocate_entry(index_path, json_file_path, os.path.abspath(new_json_path),
+                                     os.path.abspath(new_file_path))
 
 @click.command()
 @click.option('--paper-dir', default='./papers', help='指定 paper 目录')
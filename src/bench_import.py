@@ -0,0 +1,32 @@
+import sys
+import statistics
+import subprocess
+
+import click
+
+DEFAULT_MODULES = ['detect', 'web', 'ocr', 'agent']
+
+def measure_import(module: str) -> float:
+    """
+    在全新的解释器中导入模块，返回耗时（秒）
+    :param module: 模块名
+    :return: 导入耗时
+    """
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'导入 {module} 失败: {result.stderr.strip()}')
+    return float(result.stdout.strip().splitlines()[-1])
+
+@click.command()
+@click.option('--repeat', default=5, help='每个模块重复测量次数')
+@click.argument('modules', nargs=-1)
+def main(repeat: int, modules: tuple[str, ...]):
+    """测量各模块的冷启动导入耗时"""
+    for module in modules or DEFAULT_MODULES:
+        timings = [measure_import(module) for _ in range(repeat)]
+        click.echo(f'{module}: 中位数 {statistics.median(timings) * 1000:.1f} ms, '
+                   f'最大 {max(timings) * 1000:.1f} ms')
+
+if __name__ == "__main__":
+    main()
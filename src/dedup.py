@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import os
+import json
+import difflib
+from typing import TYPE_CHECKING
+from typing_extensions import TypedDict
+
+from paper_typing import PaperFile
+
+if TYPE_CHECKING:
+    from cv2.typing import MatLike
+
+INDEX_FILE_NAME = '.phash_index.json'
+# 哈希只用于初筛候选，最终由 OCR 文字相似度确认，因此阈值放宽以免漏掉光线、位置不同的重扫
+DEFAULT_PHASH_THRESHOLD = 16
+DEFAULT_DHASH_THRESHOLD = 16
+DEFAULT_TEXT_SIMILARITY = 0.9
+
+class PageHash(TypedDict):
+    phash: str
+    dhash: str
+
+class IndexEntry(TypedDict):
+    source: str
+    result: str
+    pages: list[PageHash]
+
+def _bits_to_hex(bits) -> str: # pyright: ignore[reportUnknownParameterType, reportMissingParameterType]
+    value = 0
+    for bit in bits.flatten(): # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+        value = (value << 1) | int(bit) # pyright: ignore[reportUnknownArgumentType]
+    return f'{value:016x}'
+
+def page_hash(img: MatLike) -> PageHash:
+    """
+    计算单页图片的 pHash 与 dHash（各 64 位）
+    :param img: 图片
+    :return: 十六进制表示的哈希值
+    """
+    import cv2
+    import numpy as np
+
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    # pHash: 32x32 灰度图做 DCT，取左上角 8x8 低频分量与中位数比较
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    phash = low > np.median(low.flatten()[1:])
+    # dHash: 9x8 灰度图，比较相邻像素亮度
+    tiny = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    dhash = tiny[:, 1:] > tiny[:, :-1]
+    return {"phash": _bits_to_hex(phash), "dhash": _bits_to_hex(dhash)}
+
+def paper_hashes(s_file: PaperFile) -> list[PageHash]:
+    """
+    计算试卷每一页的感知哈希
+    :param s_file: 图片路径或 PDF 页面图片列表
+    :return: 每页的哈希值
+    """
+    import cv2
+
+    if isinstance(s_file, list):
+        return [page_hash(img) for img in s_file]
+    img = cv2.imread(s_file)
+    if img is None:
+        return []
+    return [page_hash(img)]
+
+def hamming(a: str, b: str) -> int:
+    """计算两个十六进制哈希值的汉明距离"""
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+def text_similarity(a: list[str], b: list[str]) -> float:
+    """
+    比较两份 OCR 文字的相似度，用于确认感知哈希匹配的试卷内容确实相同
+    :param a: OCR 文字列表
+    :param b: OCR 文字列表
+    :return: 0-1 之间的相似度
+    """
+    return difflib.SequenceMatcher(None, ''.join(a), ''.join(b), autojunk=False).ratio()
+
+def load_index(index_path: str) -> list[IndexEntry]:
+    """
+    读取哈希索引文件，不存在时返回空索引
+    :param index_path: 索引文件路径
+    :return: 索引条目列表
+    """
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_index(index: list[IndexEntry], index_path: str):
+    """
+    保存哈希索引文件
+    :param index: 索引条目列表
+    :param index_path: 索引文件路径
+    """
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=4)
+
+def find_duplicate(index: list[IndexEntry], pages: list[PageHash], source: str,
+                   phash_threshold: int = DEFAULT_PHASH_THRESHOLD,
+                   dhash_threshold: int = DEFAULT_DHASH_THRESHOLD) -> IndexEntry | None:
+    """
+    在索引中查找近似重复的试卷：页数相同且每页的 pHash、dHash 汉明距离均不超过阈值。
+    试卷自身的条目以及结果文件已不存在的条目不参与比较。
+    :param index: 索引条目列表
+    :param pages: 待查试卷每页的哈希值
+    :param source: 待查试卷文件路径
+    :param phash_threshold: pHash 汉明距离阈值
+    :param dhash_threshold: dHash 汉明距离阈值
+    :return: 距离最近的匹配条目，未找到时返回 None
+    """
+    if not pages:
+        return None
+    source = os.path.abspath(source)
+    best: IndexEntry | None = None
+    best_distance = 0
+    for entry in index:
+        if len(entry["pages"]) != len(pages):
+            continue
+        if os.path.abspath(entry["source"]) == source or not os.path.exists(entry["result"]):
+            continue
+        distances = [(hamming(a["phash"], b["phash"]), hamming(a["dhash"], b["dhash"]))
+                     for a, b in zip(entry["pages"], pages)]
+        if all(p <= phash_threshold and d <= dhash_threshold for p, d in distances):
+            distance = sum(p + d for p, d in distances)
+            if best is None or distance < best_distance:
+                best, best_distance = entry, distance
+    return best
+
+def add_entry(index: list[IndexEntry], source: str, result: str, pages: list[PageHash]):
+    """
+    将已处理的试卷加入索引，同一试卷或同一结果文件只保留一条记录
+    :param index: 索引条目列表
+    :param source: 试卷文件路径
+    :param result: 结果 JSON 文件路径
+    :param pages: 每页的哈希值
+    """
+    if not pages:
+        return
+    index[:] = [e for e in index if e["result"] != result and e["source"] != source]
+    index.append({"source": source, "result": result, "pages": pages})
+
+def relocate_entry(index_path: str, old_result: str, new_result: str, new_source: str):
+    """
+    试卷及结果 JSON 被移动（例如归档）后，更新索引中的路径
+    :param index_path: 索引文件路径
+    :param old_result: 原结果 JSON 路径
+    :param new_result: 新结果 JSON 路径
+    :param new_source: 新试卷文件路径
+    """
+    index = load_index(index_path)
+    changed = False
+    for entry in index:
+        if os.path.abspath(entry["result"]) == os.path.abspath(old_result):
+            entry["result"] = new_result
+            entry["source"] = new_source
+            changed = True
+    if changed:
+        save_index(index, index_path)
@@ -1,32 +1,45 @@
+from __future__ import annotations
+
 import os
 import json
 import asyncio
-from typing import Any
+from functools import lru_cache
+from typing import Any, TYPE_CHECKING
 from dotenv import load_dotenv
 
-import cv2
 import filetype
-import pymupdf
-import numpy as np
 import asyncclick as click
 
 from tqdm import tqdm
 from ocr import orc_update_paper_info
-from agent import category_update_paper_info, mistakes_update_paper_info
+from agent import category_update_paper_info, mistakes_update_paper_info, mistakes_retry_pages
 from paper_typing import PaperFile
+import dedup
 
-import logfire
-
-load_dotenv()
-# configure logfire
-logfire.configure(send_to_logfire='if-token-present')
-logfire.instrument_openai()
+if TYPE_CHECKING:
+    import cv2
+    import pymupdf
 
 handlers = [ 
     orc_update_paper_info, 
     category_update_paper_info,
     mistakes_update_paper_info
 ]
+handler_map = {func.__name__: func for func in handlers}
+
+@lru_cache(maxsize=None)
+def setup_logfire() -> None:
+    """
+    加载环境变量并配置 logfire（仅在真正需要处理试卷时执行一次）
+    """
+    import logfire
+
+    # 在处理任何试卷之前检查配置，避免 OCR 完成后才发现缺少 .env
+    if not load_dotenv():
+        print("环境变量加载失败")
+        exit(1)
+    logfire.configure(send_to_logfire='if-token-present')
+    logfire.instrument_openai()
 
 def get_files(image_dir:str)-> list[str]:
     """
@@ -46,6 +59,41 @@ def get_files(image_dir:str)-> list[str]:
                     paper_files.append(os.path.join(root, file))
     return paper_files
 
+def is_incomplete(data: dict[str, Any]) -> bool: # pyright: ignore[reportExplicitAny]
+    """判断识别结果是否只部分完成（有出错的处理函数或失败的页）"""
+    return bool(data.get("failed_handlers") or data.get("failed_pages"))
+
+def get_failed_files(image_dir:str)-> list[str]:
+    """
+    遍历指定目录，获取同名 json 文件只部分完成的文件路径
+    :param image_dir: 图片目录路径
+    :return: 文件路径列表
+    """
+    paper_files:list[str] = []
+    for root, _, files in os.walk(image_dir):
+        for file in files:
+            if file.lower()[-4:] in [".png", ".jpg", ".jpeg", ".pdf"]:
+                json_file_path = os.path.join(root, os.path.splitext(file)[0] + ".json")
+                if not os.path.exists(json_file_path):
+                    continue
+                with open(json_file_path, 'r', encoding='utf-8') as f:
+                    if is_incomplete(json.load(f)):
+                        paper_files.append(os.path.join(root, file))
+    return paper_files
+
+def load_paper(file_url:str) -> PaperFile | None:
+    """
+    读取试卷文件，PDF 转换为页面图片列表
+    :param file_url: 试卷文件路径
+    :return: 图片路径或页面图片列表，无法判断类型时返回 None
+    """
+    kind = filetype.guess(file_url) # pyright: ignore[reportUnknownMemberType]
+    if kind is None:
+        print('无法判断文件类型!')
+        return None
+    if kind.extension == 'pdf':
+        return process_pdf(file_url)
+    return file_url
 
 def process_pdf(pdf_url:str) -> list[cv2.typing.MatLike]:
     """
@@ -54,6 +102,10 @@ def process_pdf(pdf_url:str) -> list[cv2.typing.MatLike]:
     :param pdf_url: PDF 文件路径
     :return: OCR 识别结果
     """
+    import cv2
+    import pymupdf
+    import numpy as np
+
     def convert_img(page: pymupdf.Page) -> cv2.typing.MatLike:
         pix: pymupdf.Pixmap = page.get_pixmap(dpi=200) # pyright: ignore[reportAttributeAccessIssue, reportUnknownMemberType, reportUnknownVariableType]
         img = np.frombuffer(pix.samples, dtype=np.uint8) # pyright: ignore[reportUnknownArgumentType, reportUnknownMemberType]
@@ -66,12 +118,12 @@ def process_pdf(pdf_url:str) -> list[cv2.typing.MatLike]:
         return [ convert_img(page) for page in doc ]
 
 
-async def save_result_to_json(data, img_url:str): # pyright: ignore[reportUnknownParameterType,reportMissingParameterType]
+async def save_result_to_json(data, img_url:str) -> str: # pyright: ignore[reportUnknownParameterType,reportMissingParameterType]
     """
     将 OCR 识别结果保存为 JSON 文件
     :param result: OCR 识别结果
     :param img_url: 图片文件路径
-    :param agent: 智能体实例
+    :return: JSON 文件路径
     """
     file_name = os.path.basename(img_url)
     result_file = os.path.splitext(file_name)[0] + ".json"
@@ -79,39 +131,152 @@ async def save_result_to_json(data, img_url:str): # pyright: ignore[reportUnknow
     
     with open(result_file_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=4)
+    return result_file_path
+
+def confirm_duplicate(entry: dedup.IndexEntry, img_url: str, data: dict[str, Any], # pyright: ignore[reportExplicitAny]
+                      min_similarity: float) -> dict[str, Any] | None: # pyright: ignore[reportExplicitAny]
+    """
+    感知哈希只用于初筛，OCR 文字与已有结果足够相似时才认定为重复
+    :param entry: 匹配到的索引条目
+    :param img_url: 当前试卷文件路径
+    :param data: 当前试卷的 OCR 结果
+    :param min_similarity: 文字相似度阈值
+    :return: 已有的识别结果，文字内容不一致时返回 None
+    """
+    with open(entry["result"], 'r', encoding='utf-8') as f:
+        result: dict[str, Any] = json.load(f) # pyright: ignore[reportExplicitAny]
+    similarity = dedup.text_similarity(data.get("texts") or [], result.get("texts") or [])
+    if similarity < min_similarity:
+        tqdm.write(f"{img_url} 与 {entry['source']} 哈希相近但文字相似度仅 {similarity:.2f}，按新试卷处理")
+        return None
+    return result
+
+async def run_handlers(data: dict[str, Any], s_file: PaperFile, source: str, funcs: list[Any]) -> None: # pyright: ignore[reportExplicitAny]
+    """
+    依次执行处理函数，出错时将该函数及其后未执行的函数名记录到 data["failed_handlers"]
+    :param data: 识别结果
+    :param s_file: 试卷扫描图
+    :param source: 试卷文件路径
+    :param funcs: 处理函数列表
+    """
+    data.pop("failed_handlers", None)
+    for i, updator_func in enumerate(funcs):
+        tqdm.write(f"正在使用 {updator_func.__name__} 进行更新...")
+        try:
+            await updator_func(data, s_file, source)
+        except Exception as e:
+            tqdm.write(f"!!处理 {updator_func.__name__} 时出错: {e}")
+            data["failed_handlers"] = [func.__name__ for func in funcs[i:]]
+            return
+
+async def retry_paper(file_url: str, s_file: PaperFile, concurrency: int) -> dict[str, Any]: # pyright: ignore[reportExplicitAny]
+    """
+    读取部分完成的识别结果，只重新执行失败的处理函数和失败的页
+    :param file_url: 试卷文件路径
+    :param s_file: 试卷扫描图
+    :param concurrency: 重新提交页面的并发数
+    :return: 合并后的识别结果
+    """
+    json_file_path = os.path.splitext(file_url)[0] + ".json"
+    with open(json_file_path, 'r', encoding='utf-8') as f:
+        data: dict[str, Any] = json.load(f) # pyright: ignore[reportExplicitAny]
+
+    failed_funcs = [handler_map[name] for name in data.get("failed_handlers", [])]
+    # 错题分析整体失败时会重新处理所有页，无需单独重试
+    if data.get("failed_pages") and mistakes_update_paper_info not in failed_funcs:
+        tqdm.write(f"正在重新提交第 {data['failed_pages']} 页...")
+        try:
+            await mistakes_retry_pages(data, s_file, file_url, concurrency)
+        except Exception as e:
+            tqdm.write(f"!!重新提交失败页时出错: {e}")
+    if failed_funcs:
+        await run_handlers(data, s_file, file_url, failed_funcs)
+    return data
 
 @click.command()
 @click.option('--paper-dir', default='./papers', help='指定 paper 目录')
-async def main(paper_dir: str):
+@click.option('--duplicate-action', type=click.Choice(['reuse', 'flag', 'off']), default='flag',
+              help='经 OCR 确认为重复试卷时的处理方式：reuse 复用已有结果，flag 标记为重复并跳过，off 不检测')
+@click.option('--phash-threshold', type=click.IntRange(0, 64), default=dedup.DEFAULT_PHASH_THRESHOLD,
+              help='pHash 汉明距离阈值（0-64）')
+@click.option('--dhash-threshold', type=click.IntRange(0, 64), default=dedup.DEFAULT_DHASH_THRESHOLD,
+              help='dHash 汉明距离阈值（0-64）')
+@click.option('--text-similarity', type=click.FloatRange(0, 1), default=dedup.DEFAULT_TEXT_SIMILARITY,
+              help='确认重复所需的 OCR 文字相似度（0-1）')
+@click.option('--retry-failed', is_flag=True, help='只重新处理上次失败的处理步骤和页，并合并到已有 JSON')
+@click.option('--concurrency', type=click.IntRange(min=1), default=4, help='--retry-failed 时同时提交的页数')
+async def main(paper_dir: str, duplicate_action: str, phash_threshold: int, dhash_threshold: int,
+               text_similarity: float, retry_failed: bool, concurrency: int):
 
     # 指定试卷目录
     paper_directory = paper_dir  # 默认值保持向后兼容
     # 获取所有需要处理的 PNG 文件路径
-    paper_files = get_files(paper_directory)
+    if retry_failed:
+        paper_files = get_failed_files(paper_directory)
+    else:
+        paper_files = get_files(paper_directory)
+        # 部分完成的试卷已有 JSON，get_files 不会再返回，需提示用户重试
+        incomplete_count = len(get_failed_files(paper_directory))
+        if incomplete_count:
+            print(f'有 {incomplete_count} 份试卷未全部完成，可使用 --retry-failed 重试。')
+    if not paper_files:
+        print('没有需要处理的试卷。')
+        return
+    setup_logfire()
+    index_path = os.path.join(paper_directory, dedup.INDEX_FILE_NAME)
+    index = dedup.load_index(index_path)
     # 遍历处理所有 PNG 文件
     for file_url in tqdm(paper_files):
         tqdm.write(f"正在处理 {file_url} ...")
-        kind = filetype.guess(file_url) # pyright: ignore[reportUnknownMemberType]
-        if kind is None:
-            print('无法判断文件类型!')
+        s_file = load_paper(file_url)
+        if s_file is None:
             continue
-        s_file: PaperFile | None = None
-        if kind.extension == 'pdf':
-            s_file = process_pdf(file_url)
+
+        # 即使关闭重复检测也要计算哈希并写入索引，以便之后识别重扫
+        pages = dedup.paper_hashes(s_file)
+
+        data: dict[str, Any]  # pyright: ignore[reportExplicitAny]
+        if retry_failed:
+            data = await retry_paper(file_url, s_file, concurrency)
         else:
-            s_file = file_url
-        
-        data: dict[str, Any] = {}  # pyright: ignore[reportExplicitAny]
-        try:
-            last_func_name = None
-            for updator_func in handlers:
-                last_func_name = updator_func.__name__
-                tqdm.write(f"正在使用 {updator_func.__name__} 进行更新...")
-                await updator_func(data, s_file)
+            data = {}
+            entry = None
+            if duplicate_action != 'off':
+                entry = dedup.find_duplicate(index, pages, file_url, phash_threshold, dhash_threshold)
+            if entry is None:
+                await run_handlers(data, s_file, file_url, handlers)
+            else:
+                # 先做 OCR，确认文字内容一致后才认定为重复
+                await run_handlers(data, s_file, file_url, [orc_update_paper_info])
+                result = None
+                if is_incomplete(data):
+                    # OCR 失败时后续步骤都未执行，一并记录以便重试
+                    data["failed_handlers"] = [func.__name__ for func in handlers]
+                else:
+                    result = confirm_duplicate(entry, file_url, data, text_similarity)
+                if result is not None:
+                    if duplicate_action == 'flag':
+                        # 保存标记文件，避免每次运行都重新检测；archive.py 会将其移入重复目录
+                        tqdm.write(f"!!{file_url} 与 {entry['source']} 重复，已标记并跳过")
+                        data.update({"duplicate_of": entry["source"], "duplicate_flagged": True})
+                        await save_result_to_json(data, file_url)
+                    else:
+                        # 保留本次扫描自己的 OCR 结果，只复用学科、标题和错题
+                        tqdm.write(f"{file_url} 与 {entry['source']} 重复，复用已有结果")
+                        result.update(data)
+                        result["duplicate_of"] = entry["source"]
+                        await save_result_to_json(result, file_url)
+                    continue
+                if not is_incomplete(data):
+                    await run_handlers(data, s_file, file_url, [func for func in handlers if func is not orc_update_paper_info])
 
-            await save_result_to_json(data, file_url)
-        except Exception as e:
-            tqdm.write(f"!!处理 {last_func_name} 时出错: {e}")
+        # 部分失败时也保存结果，下次用 --retry-failed 只重做失败的部分
+        result_path = await save_result_to_json(data, file_url)
+        if is_incomplete(data):
+            tqdm.write(f"!!{file_url} 未全部完成，可使用 --retry-failed 重试")
+        else:
+            dedup.add_entry(index, os.path.abspath(file_url), os.path.abspath(result_path), pages)
+            dedup.save_index(index, index_path)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,24 @@
-from typing import Any
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Any, TYPE_CHECKING
 
-from rapidocr import RapidOCR # pyright: ignore[reportMissingTypeStubs]
 from paper_typing import PaperFile
 
-def initialize_ocr_engine():
-    """初始化 RapidOCR 引擎"""
-    return RapidOCR()
+if TYPE_CHECKING:
+    from rapidocr import RapidOCR # pyright: ignore[reportMissingTypeStubs]
 
-engine = initialize_ocr_engine()
+@lru_cache(maxsize=None)
+def get_ocr_engine() -> RapidOCR:
+    """
+    获取 RapidOCR 引擎（首次调用时初始化，之后复用）
+    :return: RapidOCR 引擎实例
+    """
+    from rapidocr import RapidOCR # pyright: ignore[reportMissingTypeStubs]
+    return RapidOCR()
 
-async def orc_update_paper_info(info:dict[str, Any], s_file: PaperFile) -> None: # pyright: ignore[reportExplicitAny]
+async def orc_update_paper_info(info:dict[str, Any], s_file: PaperFile, source: str) -> None: # pyright: ignore[reportExplicitAny, reportUnusedParameter]
+    engine = get_ocr_engine()
     if isinstance(s_file, list):
         result = engine(s_file[0])
     else:
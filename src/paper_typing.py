@@ -1,4 +1,8 @@
+from typing import TYPE_CHECKING
 from typing_extensions import TypeAlias
-from cv2.typing import MatLike
 
-PaperFile: TypeAlias = str | list[MatLike]
+if TYPE_CHECKING:
+    from cv2.typing import MatLike
+
+# 仅在类型检查时引入 cv2，避免导入本模块时加载 OpenCV
+PaperFile: TypeAlias = "str | list[MatLike]"
@@ -8,7 +8,6 @@ from fastapi.responses import FileResponse, JSONResponse
 # from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-import uvicorn
 import json
 
 BASE_DIR = Path(__file__).parent
@@ -75,4 +74,5 @@ async def get_json_info(path: str):
         raise HTTPException(status_code=500, detail=f'读取JSON文件时出错: {str(e)}')
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("web:app", host="127.0.0.1", port=8000, log_level="info")